@@ -0,0 +1,210 @@
+import sys
+import os
+import json
+import struct
+from collections import defaultdict
+import numpy
+
+if len(sys.argv) >= 2:
+    FILE = sys.argv[1]
+else:
+    FILE = "trace.bin"
+
+if len(sys.argv) >= 3:
+    OUTPUT = sys.argv[2]
+else:
+    # E.g. trace.bin to trace-chrome.json
+    OUTPUT = os.path.splitext(FILE)[0] + "-chrome.json"
+
+# Phases, as encoded in the lowest two bits of an event's code.
+BEGIN, END, INSTANT = 0, 1, 2
+
+# Kinds of spans that make up the work of a worker thread. Time spent in
+# find-work is considered idle time: the thread waits for work.
+WORK_KINDS = ["find-path", "route-batch", "commit-batch"]
+
+def read_utf(data, offset):
+    (length,) = struct.unpack_from(">H", data, offset)
+    offset += 2
+    return data[offset:offset + length].decode("utf-8"), offset + length
+
+def read_trace(filename):
+    """Reads a trace file written by labyrinth.trace/dump.
+    Returns (kinds, threads), where threads is a list of dicts with keys id,
+    name, start, n_total, and events. Events is a NumPy array of shape (n, 3), with
+    columns timestamp (ns), code, and argument."""
+    with open(filename, "rb") as file:
+        data = file.read()
+    if data[0:4] != b"LBTR":
+        raise ValueError("%s is not a trace file" % filename)
+    version, n_kinds = struct.unpack_from(">ii", data, 4)
+    if version != 2:
+        raise ValueError("Unsupported trace version %d" % version)
+    offset = 12
+    kinds = []
+    for _ in range(n_kinds):
+        kind, offset = read_utf(data, offset)
+        kinds.append(kind)
+    (n_threads,) = struct.unpack_from(">i", data, offset)
+    offset += 4
+    threads = []
+    for _ in range(n_threads):
+        (thread_id,) = struct.unpack_from(">q", data, offset)
+        name, offset = read_utf(data, offset + 8)
+        start, n_total, n_stored = struct.unpack_from(">qqi", data, offset)
+        offset += 20
+        events = numpy.frombuffer(data, dtype=">i8", count=n_stored * 3,
+            offset=offset).reshape((n_stored, 3)).astype(numpy.int64)
+        offset += n_stored * 3 * 8
+        threads.append({"id": thread_id, "name": name, "start": start,
+            "n_total": n_total, "events": events})
+    return kinds, threads
+
+def match_spans(kinds, thread):
+    """Matches begin and end events of a thread. Returns a dict
+    kind -> NumPy array of shape (n, 3), with columns start, end, argument.
+    Also returns the timestamps of instant events, as a dict kind -> array.
+    Unmatched events (e.g. because the ring buffer overflowed) are ignored."""
+    spans = defaultdict(list)
+    instants = defaultdict(list)
+    stack = []
+    for ts, code, arg in thread["events"]:
+        kind, phase = kinds[code >> 2], code & 3
+        if phase == BEGIN:
+            stack.append((kind, ts))
+        elif phase == END:
+            if stack and stack[-1][0] == kind:
+                _, start = stack.pop()
+                spans[kind].append((start, ts, arg))
+        else:
+            instants[kind].append((ts, arg))
+    return ({k: numpy.array(v, dtype=numpy.int64) for k, v in spans.items()},
+            {k: numpy.array(v, dtype=numpy.int64) for k, v in instants.items()})
+
+def total(spans, kind):
+    if kind not in spans:
+        return 0
+    return int(numpy.sum(spans[kind][:, 1] - spans[kind][:, 0]))
+
+def retries(spans, instants, kinds):
+    """For all spans of the given kinds of a thread, returns (n_tx, n_retried,
+    n_tries, retry_cost), where the retry cost is the time spent in attempts
+    that were rolled back, i.e. the time between the first and the last
+    attempt."""
+    n_tx, n_retried, n_tries, cost = 0, 0, 0, 0
+    if "tx-try" not in instants:
+        return n_tx, n_retried, n_tries, cost
+    tries = instants["tx-try"][:, 0]
+    for kind in kinds:
+        for start, end, _ in spans.get(kind, []):
+            attempts = tries[(tries >= start) & (tries <= end)]
+            if len(attempts) == 0:
+                continue
+            n_tx += 1
+            n_tries += len(attempts)
+            if len(attempts) > 1:
+                n_retried += 1
+                cost += int(attempts[-1] - attempts[0])
+    return n_tx, n_retried, n_tries, cost
+
+def ms(ns):
+    return ns / 1000000.0
+
+def thread_bounds(thread, spans):
+    """Returns (label, start, end) of a worker thread. If the ring buffer
+    wrapped, the begin of the thread span is lost: then the start recorded in
+    the buffer header and the last stored event are used instead."""
+    if "thread" in spans:
+        label, start, end = (int(spans["thread"][0, 2]),
+            int(spans["thread"][0, 0]), int(spans["thread"][0, 1]))
+    else:
+        label, start, end = ("tid {}".format(thread["id"]), thread["start"],
+            int(thread["events"][-1, 0]))
+    return label, start, end
+
+def is_worker(spans):
+    return any(k in spans for k in ["thread", "find-work"] + WORK_KINDS)
+
+def summarize(kinds, threads):
+    out = ""
+    dropped = sum(t["n_total"] - len(t["events"]) for t in threads)
+    if dropped > 0:
+        out += "Warning: {} events were dropped (ring buffers full), the " \
+            "summary only covers the events that were kept. Use -r to " \
+            "increase the ring buffer size.\n".format(dropped)
+
+    matched = [(t, *match_spans(kinds, t)) for t in threads]
+    workers = [(t, s, i, *thread_bounds(t, s)) for t, s, i in matched
+        if is_worker(s)]
+    if not workers:
+        return out + "No worker threads found in trace.\n"
+    wall_start = min(w[4] for w in workers)
+    wall_end = max(w[5] for w in workers)
+    wall = max(wall_end - wall_start, 1)
+
+    out += "Wall time: {:.3f} ms\n".format(ms(wall))
+
+    out += "\nWorker threads:\n"
+    out += "thread,busy ms,find-work ms,idle ms,utilization,transactions," \
+        "retried,tries,retry ms,find-work retried,find-work retry ms\n"
+    all_busy, all_retry = 0, 0
+    for thread, spans, instants, label, _, _ in sorted(workers,
+            key=lambda w: w[4]):
+        busy = sum(total(spans, k) for k in WORK_KINDS)
+        waiting = total(spans, "find-work")
+        n_tx, n_retried, n_tries, cost = retries(spans, instants, WORK_KINDS)
+        _, n_fw_retried, _, fw_cost = retries(spans, instants, ["find-work"])
+        all_busy += busy
+        all_retry += cost
+        out += "{},{:.3f},{:.3f},{:.3f},{:.3f},{},{},{},{:.3f},{},{:.3f}\n" \
+            .format(label, ms(busy), ms(waiting), ms(wall - busy),
+            busy / wall, n_tx, n_retried, n_tries, ms(cost), n_fw_retried,
+            ms(fw_cost))
+    out += "Average utilization: {:.3f}\n".format(
+        all_busy / (wall * len(workers)))
+    if all_busy > 0:
+        out += "Retry cost: {:.3f} ms ({:.1%} of busy time)\n".format(
+            ms(all_retry), all_retry / all_busy)
+
+    levels = [s["bfs-level"] for _, s, _ in matched if "bfs-level" in s]
+    if levels:
+        levels = numpy.concatenate(levels)
+        durations = levels[:, 1] - levels[:, 0]
+        out += "\nBFS levels: {}, duration median {:.3f} ms, " \
+            "mean {:.3f} ms, max {:.3f} ms, mean bag size {:.1f}\n".format(
+            len(levels), ms(numpy.median(durations)), ms(numpy.mean(durations)),
+            ms(numpy.max(durations)), numpy.mean(levels[:, 2]))
+    partitions = [s["partition"] for _, s, _ in matched if "partition" in s]
+    if partitions:
+        partitions = numpy.concatenate(partitions)
+        durations = partitions[:, 1] - partitions[:, 0]
+        out += "Partitions: {} on {} threads, duration median {:.3f} ms, " \
+            "mean {:.3f} ms, max {:.3f} ms, mean size {:.1f}\n".format(
+            len(partitions),
+            sum(1 for _, s, _ in matched if "partition" in s),
+            ms(numpy.median(durations)), ms(numpy.mean(durations)),
+            ms(numpy.max(durations)), numpy.mean(partitions[:, 2]))
+    return out
+
+def to_chrome(kinds, threads):
+    """Converts the trace to the Chrome trace event format, which can be
+    opened in chrome://tracing or https://ui.perfetto.dev."""
+    phases = {BEGIN: "B", END: "E", INSTANT: "i"}
+    events = []
+    for thread in threads:
+        events.append({"name": "thread_name", "ph": "M", "pid": 0,
+            "tid": thread["id"], "args": {"name": thread["name"]}})
+        for ts, code, arg in thread["events"]:
+            event = {"name": kinds[code >> 2], "ph": phases[code & 3],
+                "ts": float(ts) / 1000.0, "pid": 0, "tid": thread["id"],
+                "args": {"arg": int(arg)}}
+            if code & 3 == INSTANT:
+                event["s"] = "t"
+            events.append(event)
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+kinds, threads = read_trace(FILE)
+print(summarize(kinds, threads), end="")
+with open(OUTPUT, "x") as f:
+    json.dump(to_chrome(kinds, threads), f)
+print("Chrome trace written to", OUTPUT)
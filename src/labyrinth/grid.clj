@@ -1,7 +1,9 @@
 (ns labyrinth.grid
   (:refer-clojure :exclude [print])
   (:require [random]
-            [labyrinth.coordinate :as coordinate]))
+            [labyrinth.coordinate :as coordinate])
+  (:import [java.util Set]
+           [java.util.concurrent ConcurrentHashMap]))
 
 (defn alloc [width height depth]
   "Returns an empty shared grid of the requested size.
@@ -41,6 +43,33 @@
                  #(ref (deref %) :resolve (fn [o p c] (min-grid-point p c)))
                  (:points grid)))}))
 
+(defn copy-local-reusable [grid]
+  "Copy a shared grid to a local grid that can be used for several expansions,
+  using reset-local in between.
+  Besides the points, it stores their initial values, and the indices of the
+  points that were changed by set-point since the last reset."
+  (dosync
+    (let [local-grid (copy-local grid)]
+      (assoc local-grid
+        :initial (mapv deref (:points local-grid))
+        :touched (ConcurrentHashMap/newKeySet)))))
+
+(defn reset-local [grid]
+  "Reset a local grid created by copy-local-reusable so it can be used for the
+  next expansion: the points changed since the last reset get their initial
+  value again, except the ones that were kept using keep-local."
+  (let [^Set touched (:touched grid)]
+    (doseq [i touched]
+      (ref-set (nth (:points grid) i) (nth (:initial grid) i)))
+    (.clear touched)))
+
+(defn keep-local [grid points]
+  "Keep the current values of `points` in a local grid created by
+  copy-local-reusable when it is reset."
+  (when-let [^Set touched (:touched grid)]
+    (doseq [point points]
+      (.remove touched (get-point-index grid point)))))
+
 (defn is-point-valid? [grid {x :x y :y z :z}]
   "Is the point valid, i.e. within the boundaries of `grid`?"
   (and
@@ -68,7 +97,10 @@
 
 (defn set-point [grid point v]
   "Set a point in the grid to `v`."
-  (ref-set (nth (:points grid) (get-point-index grid point)) v))
+  (let [i (get-point-index grid point)]
+    (when-let [^Set touched (:touched grid)]
+      (.add touched i))
+    (ref-set (nth (:points grid) i) v)))
 
 (defn get-point-cost [grid point]
   "Get the cost associated to a point in the grid, or throws an exception if
@@ -81,6 +113,11 @@
     (doseq [point path]
       (set-point grid point :full))))
 
+(defn path-free? [grid path]
+  "Are all points in `path` not full in `grid`? The source and destination of
+  the path are not checked, as these are always full in the shared grid."
+  (not-any? #(= (get-point grid %) :full) (rest (butlast path))))
+
 (defn- print-point [val]
   (case val
     :empty "  . "
@@ -3,6 +3,7 @@
   (:refer-clojure :exclude [time])
   (:require [labyrinth.maze :as maze]
             [labyrinth.router :as router]
+            [labyrinth.trace :as trace]
             [labyrinth.util :refer [str->int time print-tx-stats]]
             [taoensso.tufte :as tufte :refer [profiled p format-pstats]]))
 
@@ -18,12 +19,15 @@
    :variant    :pbfs
    :n-threads  1
    :n-partitions 4
+   :batch-size 1
    :x-cost     20
    :y-cost     20
    :z-cost     60
    :bend-cost  1
    :print      false
-   :profile    false})
+   :profile    false
+   :trace-file nil
+   :trace-capacity trace/default-capacity})
 
 (def usage
 "Usage: lein run -- [options]
@@ -32,12 +36,15 @@ Options:                    values        default
   i  [i]nput file name      <FILE>        (labyrinth/inputs/random-x32-y32-z3-n96.txt)
   v  [v]ariant              original|pbfs (pbfs)
   t  number of [t]hreads    <UINT>        (1)
+  k  paths per batch        <UINT>        (1)
   x  [x] movement cost      <UINT>        (1)
   y  [y] movement cost      <UINT>        (1)
   z  [z] movement cost      <UINT>        (2)
   b  [b]end cost            <INT>         (1)
   p  [p]rint routed maze                  (false)
   m  enable profiling                     (false)
+  o  trace [o]utput file    <FILE>        (none)
+  r  t[r]ace events/thread  <UINT>        (65536)
 
 Only for pbfs variant:
   a  number of p[a]rtitions <UINT>        (4)")
@@ -60,12 +67,18 @@ Only for pbfs variant:
                                     :pbfs))
                 "t" #(assoc res :n-threads (str->int %))
                 "a" #(assoc res :n-partitions (str->int %))
+                "k" #(assoc res :batch-size (str->int %))
                 "x" #(assoc res :x-cost (str->int %))
                 "y" #(assoc res :y-cost (str->int %))
                 "z" #(assoc res :z-cost (str->int %))
                 "b" #(assoc res :bend-cost (str->int %))
                 "p" (assoc res :print true)
                 "m" (assoc res :profile true)
+                "o" #(assoc res :trace-file %)
+                "r" #(let [n (str->int %)]
+                       (if (and n (pos? n))
+                         (assoc res :trace-capacity n)
+                         (assoc res :arg-error true)))
                     (assoc res :arg-error true))
               (assoc default-args :arg-error true)))
         process-argument-value
@@ -99,6 +112,8 @@ Only for pbfs variant:
       (println "Specify an input file using the command line parameter -i.")
       (System/exit 2))
     (tufte/set-min-level! (if (:profile params) 0 6))
+    (when (:trace-file params)
+      (trace/enable! (:trace-capacity params)))
     (println "Variant         =" (:variant params))
     (let [maze
             (maze/read (:input-file params))
@@ -107,15 +122,17 @@ Only for pbfs variant:
           [[results total-time] pstats]
             (profiled {:level 3 :dynamic? true}
               (p :all (time ; time/profile everything
-                (parallel-for-all [_i (range (:n-threads params))]
+                (parallel-for-all [i (range (:n-threads params))]
                   (p :thread (time ; timer/profile per thread
-                    (router/solve params maze paths-per-thread)))))))]
+                    (trace/span :thread i
+                      (router/solve params maze paths-per-thread))))))))]
       ;(log "Paths (per thread):" @paths-per-thread)
       (println "Paths routed    =" (reduce + (map count @paths-per-thread)))
       (println "Elapsed time    =" total-time "milliseconds")
       (println "Time per thread:")
       (doseq [[_result thread-time] results]
         (println " " thread-time "milliseconds"))
+      (println "Batch size:" (:batch-size params))
       (print-tx-stats)
       ; verification of paths, also prints grid if asked to
       ; Note: (apply concat ...) flattens once, i.e. it turns the list of
@@ -126,6 +143,9 @@ Only for pbfs variant:
         (println "Verification passed.")
         (println "Verification FAILED!"))
       (when (:profile params) (println (format-pstats pstats)))
+      (when (:trace-file params)
+        (trace/dump (:trace-file params))
+        (println "Trace written to" (:trace-file params)))
       (shutdown-agents))))
 
 ; To run manually:
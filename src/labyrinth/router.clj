@@ -1,7 +1,8 @@
 (ns labyrinth.router
   (:require [labyrinth.coordinate :as coordinate]
             [labyrinth.grid :as grid]
-            [labyrinth.util :refer [dosync-tracked]]
+            [labyrinth.trace :as trace]
+            [labyrinth.util :refer [dosync-tracked track-batch]]
             [taoensso.tufte :as tufte :refer [defnp p]])
   (:import [java.io StringWriter]
            [java.util LinkedList]
@@ -122,7 +123,9 @@
         (p :expand-partitions
           (parallel-for-all [partition partitions]
             (p :expand-partition
-              (expand-partition partition new-bag dst local-grid found? params))))))
+              (trace/span :partition (count partition)
+                (expand-partition partition new-bag dst local-grid found?
+                  params)))))))
     new-bag))
 
 (defnp expand-bag [local-grid src dst params]
@@ -142,7 +145,8 @@
   https://www.youtube.com/watch?v=M4HSekx-8XA"
   (let [found? (ref false :resolve (fn [o p c] (or p c)))]
     (loop [bag (new-bag [src])]
-      (let [new-bag (expand-step bag dst local-grid found? params)]
+      (let [new-bag (trace/span :bfs-level (count bag)
+                      (expand-step bag dst local-grid found? params))]
         (cond
           @found?          true
           (empty? new-bag) false
@@ -215,46 +219,144 @@
 (defnp find-work [queue]
   "In a transaction, pops element of queue and returns it, or returns nil
   if queue is empty."
-  (let [work
-          (dosync
-            (if (empty? @queue)
-              nil
-              (let [top (first @queue)]
-                (alter queue rest)
-                top)))]
+  (let [tries (atom 0)
+        work
+          (trace/span :find-work 1
+            (dosync
+              (trace/event :tx-try :instant (swap! tries inc))
+              (if (empty? @queue)
+                nil
+                (let [top (first @queue)]
+                  (alter queue rest)
+                  top))))]
     (log "found work" work)
     work))
 
-(defnp find-path [[src dst] shared-grid params]
+(defnp find-work-batch [queue batch-size]
+  "In a transaction, pops up to `batch-size` elements of queue and returns them
+  in a vector, which is empty if the queue is empty."
+  (let [tries (atom 0)
+        works
+          (trace/span :find-work batch-size
+            (dosync
+              (trace/event :tx-try :instant (swap! tries inc))
+              (if (empty? @queue)
+                []
+                (let [top (vec (take batch-size @queue))]
+                  (alter queue nthrest (count top))
+                  top))))]
+    (log "found work" works)
+    works))
+
+(defn route [[src dst] local-grid params]
+  "Tries to find a path from `src` to `dst` through `local-grid`. Returns path
+  if one was found, nil otherwise. The points of the path are marked as :full
+  in `local-grid`, and are kept when it is reset (see route-batch)."
+  (let [reachable?
+          (p :find-path-2-expand
+            (case (:variant params)
+              :original (expand-original src dst local-grid params)
+                        (expand-pbfs src dst local-grid params)))
+        path
+          (if reachable?
+            (p :find-path-3-traceback (traceback local-grid dst params))
+            (log "expansion failed"))]
+    (when path
+      ; traceback does not mark src, which is 0
+      (grid/set-point local-grid src :full)
+      (grid/keep-local local-grid path))
+    path))
+
+(defnp find-path [work shared-grid params]
   "Tries to find a path. Returns path if one was found, nil otherwise.
   A path is a vector of points."
-  (dosync-tracked
-    (let [local-grid (p :find-path-1-copy (grid/copy-local shared-grid))
-          reachable?
-            (p :find-path-2-expand
-              (case (:variant params)
-                :original (expand-original src dst local-grid params)
-                          (expand-pbfs src dst local-grid params)))]
-      (if reachable?
-        (let [path (p :find-path-3-traceback (traceback local-grid dst params))]
-          (when path
-            (p :find-path-4-add-path
-              (grid/add-path shared-grid path))) ; may fail and cause rollback
-          path)
-        (log "expansion failed")))))
+  (trace/span :find-path 1
+    (dosync-tracked
+      (let [local-grid (p :find-path-1-copy (grid/copy-local shared-grid))
+            path       (route work local-grid params)]
+        (when path
+          (p :find-path-4-add-path
+            (grid/add-path shared-grid path))) ; may fail and cause rollback
+        path))))
+
+(defnp route-batch [works shared-grid params]
+  "Routes the paths in `works` one after another, against a single local copy
+  of the shared grid. Later paths are routed around earlier ones. The shared
+  grid is not modified, so this transaction does not conflict with others.
+  Returns a vector containing, for each element of `works`, its path or nil."
+  (trace/span :route-batch (count works)
+    (dosync-tracked
+      (let [local-grid (p :find-path-1-copy
+                         (grid/copy-local-reusable shared-grid))]
+        (loop [works works
+               paths []]
+          (if-let [work (first works)]
+            (do
+              (when-not (empty? paths)
+                (p :route-batch-reset (grid/reset-local local-grid)))
+              (recur (rest works) (conj paths (route work local-grid params))))
+            paths))))))
+
+(defnp commit-batch [works paths shared-grid queue]
+  "Adds the longest prefix of `paths` that does not overlap with the paths
+  already in `shared-grid`, and puts the work of the remaining paths back at
+  the front of `queue`. Returns [committed-paths n-requeued].
+
+  Every point that is checked is also written by add-path, so if another
+  thread adds an overlapping path concurrently, this transaction is retried,
+  but the (expensive) routing is not."
+  (trace/span :commit-batch (count works)
+    (dosync-tracked
+      (loop [works     works
+             paths     paths
+             committed []]
+        (let [path (first paths)]
+          (cond
+            (empty? works)
+              [committed 0]
+            (nil? path) ; no path found
+              (recur (rest works) (rest paths) committed)
+            (grid/path-free? shared-grid path) ; includes earlier paths
+              (do
+                (p :find-path-4-add-path (grid/add-path shared-grid path))
+                (recur (rest works) (rest paths) (conj committed path)))
+            :else
+              (do
+                (alter queue into (reverse works))
+                [committed (count works)])))))))
+
+(defn- solve-one-by-one [params maze]
+  "Find paths one at a time, until no work left. Returns found paths."
+  (loop [my-paths []]
+    (if-let [work (find-work (:work-queue maze))]      ; find-work = tx
+      (let [path (find-path work (:grid maze) params)] ; find-path = tx
+        (log "found path" path)
+        (if path
+          (recur (conj my-paths path))
+          (recur my-paths)))
+      my-paths)))
+
+(defn- solve-batched [params maze]
+  "Find paths in batches of (:batch-size params), until no work left. Returns
+  found paths."
+  (loop [my-paths []]
+    (let [works (find-work-batch (:work-queue maze) (:batch-size params))]
+      (if (empty? works)
+        my-paths
+        (let [paths                   (route-batch works (:grid maze) params)
+              [committed n-requeued]  (commit-batch works paths (:grid maze)
+                                        (:work-queue maze))]
+          (log "found paths" committed)
+          (track-batch (count works) (count (filter some? paths))
+            (count committed) n-requeued)
+          (recur (into my-paths committed)))))))
 
 (defnp solve [params maze paths-per-thread]
   "Solve maze, append found paths to `paths-per-thread`."
   (let [my-paths
-          ; find paths until no work left
-          (loop [my-paths []]
-            (if-let [work (find-work (:work-queue maze))]      ; find-work = tx
-              (let [path (find-path work (:grid maze) params)] ; find-path = tx
-                (log "found path" path)
-                (if path
-                  (recur (conj my-paths path))
-                  (recur my-paths)))
-              my-paths))]
+          (if (> (:batch-size params) 1)
+            (solve-batched params maze)
+            (solve-one-by-one params maze))]
     ; add found paths to shared list of list of paths
     ; Note: in Clojure, it would make more sense to return my-paths and let
     ; the caller merge them (not using transactions). However, in the C++
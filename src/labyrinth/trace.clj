@@ -0,0 +1,117 @@
+(ns labyrinth.trace
+  (:import [java.io BufferedOutputStream DataOutputStream FileOutputStream]
+           [java.util.concurrent ConcurrentLinkedQueue]
+           [java.util.function Supplier]))
+
+; Low-overhead event tracer. Each thread writes timestamped events into its own
+; ring buffer, so no synchronization is needed while tracing. When the run
+; ends, all buffers are dumped to a binary file, which can be read by
+; results/trace-summary.py.
+;
+; An event consists of three longs:
+; 1. timestamp, in nanoseconds since the tracer was enabled;
+; 2. code = (kind << 2) | phase;
+; 3. an argument, whose meaning depends on the kind (e.g. the bag size for
+;    :bfs-level).
+; If a ring buffer is full, the oldest events are overwritten. The time at
+; which a buffer was created, i.e. the time of the thread's first event, is
+; stored separately so it is not lost.
+
+(def kinds
+  "Kinds of events, their index in this vector is their code."
+  [:thread :find-work :find-path :route-batch :commit-batch :tx-try :bfs-level
+   :partition])
+
+(def ^:private kind->code (zipmap kinds (range)))
+
+(def ^:private phase->code {:begin 0 :end 1 :instant 2})
+
+(def default-capacity
+  "Default number of events per thread that are kept."
+  (bit-shift-left 1 16))
+
+(def ^:private enabled (volatile! false))
+(def ^:private capacity (volatile! default-capacity))
+(def ^:private start-time (volatile! 0))
+(def ^:private ^ConcurrentLinkedQueue buffers (ConcurrentLinkedQueue.))
+
+(defn- new-buffer []
+  "Returns a new ring buffer for the current thread, and registers it."
+  (let [thread (Thread/currentThread)
+        buffer {:thread-id   (.getId thread)
+                :thread-name (.getName thread)
+                :start       (- (System/nanoTime) (long @start-time))
+                :events      (long-array (* 3 @capacity))
+                :n           (long-array 1)}] ; number of events ever written
+    (.add buffers buffer)
+    buffer))
+
+(def ^:private ^ThreadLocal local-buffer
+  (ThreadLocal/withInitial (reify Supplier (get [_] (new-buffer)))))
+
+(defn enable! [n-events]
+  "Enable tracing, keeping the last `n-events` events per thread."
+  (vreset! capacity n-events)
+  (vreset! start-time (System/nanoTime))
+  (vreset! enabled true))
+
+(defn enabled? []
+  @enabled)
+
+(defn event [kind phase arg]
+  "Record an event of the given kind and phase (:begin, :end, or :instant) in
+  the buffer of the current thread. Does nothing if tracing is not enabled."
+  (when @enabled
+    (let [buffer        (.get local-buffer)
+          ^longs events (:events buffer)
+          ^longs n      (:n buffer)
+          i             (aget n 0)
+          j             (* 3 (rem i (quot (alength events) 3)))]
+      (aset events j (- (System/nanoTime) (long @start-time)))
+      (aset events (+ j 1)
+        (bit-or (bit-shift-left (long (kind->code kind)) 2)
+                (long (phase->code phase))))
+      (aset events (+ j 2) (long (or arg 0)))
+      (aset n 0 (inc i)))))
+
+(defmacro span [kind arg & body]
+  "Evaluates `body`, surrounded by a begin and end event of `kind`."
+  `(let [arg# ~arg]
+     (event ~kind :begin arg#)
+     (try
+       ~@body
+       (finally
+         (event ~kind :end arg#)))))
+
+(defn dump [file-name]
+  "Write all buffers to `file-name`. All values are big-endian. Format:
+  * magic \"LBTR\", version (int32);
+  * number of kinds (int32), followed by their names (each a Java UTF string,
+    i.e. its length as uint16 followed by its bytes);
+  * number of buffers (int32), followed by for each buffer:
+    thread id (int64), thread name (UTF string), time of its first event
+    (int64), number of events written (int64), number of events stored
+    (int32), and the stored events in chronological order (3 int64s each)."
+  (with-open [^DataOutputStream out (DataOutputStream.
+                                      (BufferedOutputStream.
+                                        (FileOutputStream. file-name)))]
+    (.writeBytes out "LBTR")
+    (.writeInt out 2)
+    (.writeInt out (int (count kinds)))
+    (doseq [kind kinds]
+      (.writeUTF out (name kind)))
+    (.writeInt out (int (count buffers)))
+    (doseq [{:keys [thread-id thread-name start events n]} buffers]
+      (let [^longs events events
+            cap      (quot (alength events) 3)
+            n-total  (aget ^longs n 0)
+            n-stored (min n-total cap)
+            first-i  (- n-total n-stored)]
+        (.writeLong out (long thread-id))
+        (.writeUTF out ^String thread-name)
+        (.writeLong out (long start))
+        (.writeLong out n-total)
+        (.writeInt out (int n-stored))
+        (doseq [i (range first-i n-total)
+                k (range 3)]
+          (.writeLong out (aget events (+ (* 3 (rem i cap)) k))))))))
@@ -1,5 +1,6 @@
 (ns labyrinth.util
-  (:refer-clojure :exclude [time]))
+  (:refer-clojure :exclude [time])
+  (:require [labyrinth.trace :as trace]))
 
 (defn str->int [s]
   "Converts s to integer, returns nil in case of error"
@@ -26,11 +27,22 @@
           [result# time#]
             (time
               (dosync
-                (swap! tries-per-tx #(assoc % tx-i# (inc (get % tx-i# 0))))
+                (trace/event :tx-try :instant
+                  (get (swap! tries-per-tx #(assoc % tx-i# (inc (get % tx-i# 0))))
+                    tx-i#))
                 ~@body))]
       (swap! time-per-tx #(assoc % tx-i# time#))
       result#)))
 
+(def batches (atom []))
+
+(defn track-batch [n-claimed n-routed n-committed n-requeued]
+  "Record the result of one batch: the number of paths that were claimed,
+  routed, committed, and put back in the work queue."
+  (swap! batches conj
+    {:claimed n-claimed :routed n-routed :committed n-committed
+     :requeued n-requeued}))
+
 (defn- avg [xs]
   (double (/ (reduce + xs) (count xs))))
 
@@ -38,4 +50,13 @@
   (println "Number of tracked transactions:" @n-tx)
   (println "Tries per transaction:" @tries-per-tx)
   (println "Average tries per transaction:" (avg (vals @tries-per-tx)))
-  (println "Time per transaction:" @time-per-tx))
+  (println "Time per transaction:" @time-per-tx)
+  (when-not (empty? @batches)
+    (println "Number of batches:" (count @batches))
+    (println "Average paths claimed per batch:" (avg (map :claimed @batches)))
+    (println "Fraction of claimed paths routed:"
+      (double (/ (reduce + (map :routed @batches))
+                 (reduce + (map :claimed @batches)))))
+    (println "Average paths committed per batch:"
+      (avg (map :committed @batches)))
+    (println "Paths put back in queue:" (reduce + (map :requeued @batches)))))